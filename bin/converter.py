@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Pure conversion of enriched message records into AIL items
+
+No discord objects and no I/O: records are plain dicts, so batches can be
+converted in a worker process.
+"""
+
+import base64
+import json
+
+
+def unpack_embedded(embed):
+    # TODO CHECK
+    # + image
+    # + thumbnail
+    # + video
+    # + provider
+    # + author
+    # timestamp ???
+
+    content = ''  # TODO icon URL
+    if 'title' in embed:
+        if 'url' in embed:
+            content = f'[{embed["title"]}]({embed["url"]})\n'
+        else:
+            content = f'{embed["title"]}\n'
+    elif 'url' in embed:
+        content = f'{embed["url"]}\n'
+    if 'description' in embed:
+        content = f'{content}{embed["description"]}\n'
+    for field in embed.get('fields', []):
+        if field['inline']:
+            content = f'{content}{field["name"]}    {field["value"]}\n'
+        else:
+            content = f'{content}{field["name"]}\n{field["value"]}\n'
+    if embed.get('footer'):
+        content = f'{content}\n'
+        if 'icon_url' in embed['footer']:
+            content = f'{content}{embed["footer"]["icon_url"]}\n'
+        if 'text' in embed['footer']:
+            content = f'{content}{embed["footer"]["text"]}\n'
+    return content
+
+def unpack_embeds(embeds):
+    content = ''
+    for embed in embeds:
+        content = f'{content}\n{unpack_embedded(embed)}'
+    return content
+
+def convert_message(record):
+    """
+    Convert an enriched message record into a list of items to emit:
+    the message item followed by its attachments and new custom emojis.
+    """
+    meta = record['meta']
+    item = {}
+    if record.get('avatar'):
+        icon = base64.standard_b64encode(record['avatar']).decode()
+        meta['sender']['icon'] = icon
+        item['sender_icon'] = icon
+
+    content = unpack_embeds(record['embeds'])
+    meta['data'] = f'{record["content"]}\n{content}'
+    item['data'] = f'{record["content"]}{content}'
+    item['meta'] = meta
+    item['dump'] = json.dumps(meta, indent=4, sort_keys=True)
+
+    items = [item]
+    for media_content in record['attachments']:
+        attachment_meta = dict(meta)
+        attachment_meta['type'] = 'image'
+        items.append({'data': media_content, 'meta': attachment_meta})
+    for emoji in record.get('emojis', []):
+        emoji_meta = dict(emoji['meta'])
+        emoji_meta['type'] = 'emoji'
+        items.append({'data': emoji['image'], 'meta': emoji_meta, 'emoji': emoji['meta']})
+    return items
+
+def convert_messages(records):
+    items = []
+    for record in records:
+        items.extend(convert_message(record))
+    return items
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Near-duplicate messages filter
+
+Messages are fingerprinted with a 64 bits SimHash. URLs are kept as whole features,
+links, IDs and keys are what the feeder collects: messages only differing by a URL
+are distinct, and the URLs of collapsed near-duplicates are kept with the held item.
+Fingerprints are indexed by bands of 8 bits: two fingerprints within a hamming
+distance < number of bands share at least one identical band, so a lookup only
+compares a few candidates.
+"""
+
+import hashlib
+import re
+import time
+
+from collections import OrderedDict
+
+FINGERPRINT_BITS = 64
+BANDS = 8
+BAND_BITS = FINGERPRINT_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+REGEX_URLS = re.compile(r'https?://\S+|(?:[\w-]+\.)+[a-z]{2,}/\S*', re.IGNORECASE)
+REGEX_TOKENS = re.compile(r'\w+', re.UNICODE)
+
+
+def extract_urls(text):
+    return REGEX_URLS.findall(text)
+
+def _get_tokens(text):
+    # URLs are case sensitive single tokens (paths, IDs and keys), words are lowercased
+    tokens = []
+    start = 0
+    for match in REGEX_URLS.finditer(text):
+        tokens.extend(REGEX_TOKENS.findall(text[start:match.start()].lower()))
+        tokens.append(match.group())
+        start = match.end()
+    tokens.extend(REGEX_TOKENS.findall(text[start:].lower()))
+    return tokens
+
+def _get_features(text):
+    tokens = _get_tokens(text)
+    if len(tokens) < 3:
+        return tokens
+    # word shingles, more robust than single words to reordered spam
+    return [' '.join(tokens[i:i + 3]) for i in range(len(tokens) - 2)]
+
+def _hash_feature(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'big')
+
+def simhash(text):
+    vector = [0] * FINGERPRINT_BITS
+    for feature in _get_features(text):
+        h = _hash_feature(feature)
+        for i in range(FINGERPRINT_BITS):
+            if h & (1 << i):
+                vector[i] += 1
+            else:
+                vector[i] -= 1
+    fingerprint = 0
+    for i in range(FINGERPRINT_BITS):
+        if vector[i] > 0:
+            fingerprint |= 1 << i
+    return fingerprint
+
+def hamming_distance(fingerprint1, fingerprint2):
+    return bin(fingerprint1 ^ fingerprint2).count('1')
+
+def _get_bands(fingerprint):
+    return [(i, (fingerprint >> (i * BAND_BITS)) & BAND_MASK) for i in range(BANDS)]
+
+
+class DuplicateFilter:
+    """
+    Bounded, time-windowed index of recent fingerprints.
+
+    The first occurrence of a message is held until its window expires, near-duplicates
+    seen in the meantime are collapsed into it (occurrence counter, list of sources and
+    URLs not present in the held message).
+    """
+
+    def __init__(self, window=60, max_size=10000, distance=3):
+        self.window = window
+        self.max_size = max_size
+        self.distance = min(distance, BANDS - 1)
+        self.entries = OrderedDict()  # fingerprint -> entry, ordered by first seen
+        self.bands = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _lookup(self, fingerprint):
+        for band in _get_bands(fingerprint):
+            for candidate in self.bands.get(band, ()):
+                if hamming_distance(fingerprint, candidate) <= self.distance:
+                    return self.entries[candidate]
+        return None
+
+    def _index(self, fingerprint):
+        for band in _get_bands(fingerprint):
+            self.bands.setdefault(band, set()).add(fingerprint)
+
+    def _pop(self, fingerprint):
+        entry = self.entries.pop(fingerprint)
+        for band in _get_bands(fingerprint):
+            fingerprints = self.bands.get(band)
+            if fingerprints:
+                fingerprints.discard(fingerprint)
+                if not fingerprints:
+                    del self.bands[band]
+        return entry
+
+    def add(self, text, item, source):
+        """
+        Return True if the item is new and is now held by the filter,
+        False if it was collapsed into an already held item,
+        None if the text has no word or URL to fingerprint (emojis, punctuation): the item is not held.
+        """
+        if not _get_features(text):
+            return None
+        fingerprint = simhash(text)
+        urls = extract_urls(text)
+        entry = self._lookup(fingerprint)
+        if entry:
+            entry['count'] += 1
+            if source not in entry['sources']:
+                entry['sources'].append(source)
+            for url in urls:
+                if url not in entry['urls'] and url not in entry['other_urls']:
+                    entry['other_urls'].append(url)
+            return False
+        self.entries[fingerprint] = {'item': item,
+                                     'first_seen': time.monotonic(),
+                                     'count': 1,
+                                     'sources': [source],
+                                     'urls': urls,
+                                     'other_urls': []}
+        self._index(fingerprint)
+        return True
+
+    def expired(self):
+        """Pop and return held entries that are out of the window or above max_size."""
+        entries = []
+        now = time.monotonic()
+        while self.entries:
+            fingerprint, entry = next(iter(self.entries.items()))
+            if now - entry['first_seen'] < self.window and len(self.entries) <= self.max_size:
+                break
+            entries.append(self._pop(fingerprint))
+        return entries
+
+    def flush(self):
+        """Pop and return all held entries."""
+        entries = [self._pop(fingerprint) for fingerprint in list(self.entries)]
+        return entries
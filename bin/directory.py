@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local directory of guilds, subchannels, threads, DMs, known users and custom emojis
+
+SQLite snapshot refreshed by the monitor, used to answer `chats` and `entity`
+without a gateway login.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    parent INTEGER,
+    meta TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chats_parent ON chats (parent);
+CREATE INDEX IF NOT EXISTS chats_type ON chats (type);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    meta TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS emojis (
+    id INTEGER PRIMARY KEY,
+    meta TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# Chats types
+SERVER = 'server'
+SUBCHANNEL = 'server_channel'
+THREAD = 'thread'
+DM = 'dm'
+GROUP = 'group'
+
+
+class ChatDirectory:
+
+    def __init__(self, path):
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        # also updated from the pipeline emit thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def is_empty(self):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM chats LIMIT 1').fetchone() is None
+
+    # -- Chats -- #
+
+    def update_chat(self, chat_type, meta, parent=None):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO chats (id, type, parent, meta, updated) VALUES (?, ?, ?, ?, ?)',
+                              (meta['id'], chat_type, parent, json.dumps(meta), time.time()))
+
+    def update_chats(self, chats):
+        """
+        :param chats: list of (chat_type, meta, parent)
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO chats (id, type, parent, meta, updated) VALUES (?, ?, ?, ?, ?)',
+                                  [(meta['id'], chat_type, parent, json.dumps(meta), now)
+                                   for chat_type, meta, parent in chats])
+
+    def delete_chat(self, chat_id):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM chats WHERE parent IN (SELECT id FROM chats WHERE parent = ?)', (chat_id,))
+            self.conn.execute('DELETE FROM chats WHERE parent = ?', (chat_id,))
+            self.conn.execute('DELETE FROM chats WHERE id = ?', (chat_id,))
+
+    def replace_chats(self, chats):
+        """
+        Replace the chats snapshot
+
+        :param chats: list of (chat_type, meta, parent)
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM chats')
+            self.conn.executemany('INSERT OR REPLACE INTO chats (id, type, parent, meta, updated) VALUES (?, ?, ?, ?, ?)',
+                                  [(meta['id'], chat_type, parent, json.dumps(meta), now)
+                                   for chat_type, meta, parent in chats])
+
+    def _get_children(self, chat_id, chat_type):
+        rows = self.conn.execute('SELECT meta FROM chats WHERE parent = ? AND type = ? ORDER BY id',
+                                 (chat_id, chat_type))
+        return [json.loads(row[0]) for row in rows]
+
+    def get_chats(self, subchannels=False):
+        chats = []
+        with self.lock:
+            rows = self.conn.execute('SELECT id, type, meta FROM chats WHERE type IN (?, ?, ?) ORDER BY id',
+                                     (SERVER, DM, GROUP)).fetchall()
+            for chat_id, chat_type, meta in rows:
+                meta = json.loads(meta)
+                if chat_type == SERVER and subchannels:
+                    meta['subchannels'] = self._get_children(chat_id, SUBCHANNEL)
+                chats.append(meta)
+        return chats
+
+    def get_chat(self, chat_id):
+        with self.lock:
+            row = self.conn.execute('SELECT type, meta FROM chats WHERE id = ?', (chat_id,)).fetchone()
+            if not row:
+                return None
+            chat_type, meta = row
+            meta = json.loads(meta)
+            if chat_type == SERVER:
+                meta['subchannels'] = self._get_children(chat_id, SUBCHANNEL)
+        return meta
+
+    # -- Users -- #
+
+    def _merge_user(self, meta, now):
+        row = self.conn.execute('SELECT meta FROM users WHERE id = ?', (meta['id'],)).fetchone()
+        if row:
+            # keep profile fields (info, icon) not present in a partial update
+            old_meta = json.loads(row[0])
+            old_meta.update(meta)
+            meta = old_meta
+        self.conn.execute('INSERT OR REPLACE INTO users (id, meta, updated) VALUES (?, ?, ?)',
+                          (meta['id'], json.dumps(meta), now))
+
+    def update_user(self, meta):
+        with self.lock, self.conn:
+            self._merge_user(meta, time.time())
+
+    def update_users(self, metas):
+        now = time.time()
+        with self.lock, self.conn:
+            for meta in metas:
+                self._merge_user(meta, now)
+
+    def get_user(self, user_id):
+        with self.lock:
+            row = self.conn.execute('SELECT meta FROM users WHERE id = ?', (user_id,)).fetchone()
+        if row:
+            return json.loads(row[0])
+        return None
+
+    def get_entity(self, entity_id):
+        meta = self.get_chat(entity_id)
+        if meta is None:
+            meta = self.get_user(entity_id)
+        return meta
+
+    # -- Emojis -- #
+
+    def update_emoji(self, meta):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO emojis (id, meta, updated) VALUES (?, ?, ?)',
+                              (meta['id'], json.dumps(meta), time.time()))
+
+    def get_emoji(self, emoji_id):
+        with self.lock:
+            row = self.conn.execute('SELECT meta FROM emojis WHERE id = ?', (emoji_id,)).fetchone()
+        if row:
+            return json.loads(row[0])
+        return None
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import configparser
+import functools
 import json
 import os
 import sys
@@ -16,6 +18,13 @@ from datetime import datetime
 from pyail import PyAIL
 import base64
 
+import directory
+import profiling
+from converter import convert_messages, unpack_embedded
+from dedup import DuplicateFilter
+from emojis import EmojiCache
+from pipeline import MessagePipeline
+
 dir_path = os.path.dirname(os.path.realpath(__file__))
 pathConf = os.path.join(dir_path, '../etc/conf.cfg')
 
@@ -69,12 +78,54 @@ try:
         sys.exit(0)
     # /End Check Discord configuration
 
+    # Optional near-duplicate filter, collapse spam waves before submission
+    if 'DEDUP' in config:
+        try:
+            dedup = DuplicateFilter(window=config.getint('DEDUP', 'window', fallback=60),
+                                    max_size=config.getint('DEDUP', 'max_size', fallback=10000),
+                                    distance=config.getint('DEDUP', 'distance', fallback=3))
+        except ValueError as e:
+            print(e)
+            print('[ERROR] Check ../etc/conf.cfg, [DEDUP] window, max_size and distance must be integers.\n')
+            sys.exit(0)
+    else:
+        dedup = None
+
+    # Message pipeline: batch size, number of enrich workers and of convert processes (0: thread)
+    try:
+        pipeline_batch_size = config.getint('PIPELINE', 'batch_size', fallback=50)
+        pipeline_enrich_workers = config.getint('PIPELINE', 'enrich_workers', fallback=4)
+        pipeline_processes = config.getint('PIPELINE', 'processes', fallback=0)
+    except ValueError as e:
+        print(e)
+        print('[ERROR] Check ../etc/conf.cfg, [PIPELINE] batch_size, enrich_workers and processes must be integers.\n')
+        sys.exit(0)
+
+    # Local snapshot of chats and users, refreshed by the monitor
+    directory_path = config.get('DIRECTORY', 'path', fallback='../data/directory.db')
+    # relative to the bin directory, as the other paths
+    if not os.path.isabs(directory_path):
+        directory_path = os.path.join(dir_path, directory_path)
+
+    # Custom emojis cache: max number of emojis kept in memory and concurrent downloads
+    try:
+        emojis_cache_size = config.getint('EMOJIS', 'cache_size', fallback=10000)
+        emojis_downloads = config.getint('EMOJIS', 'downloads', fallback=4)
+    except ValueError as e:
+        print(e)
+        print('[ERROR] Check ../etc/conf.cfg, [EMOJIS] cache_size and downloads must be integers.\n')
+        sys.exit(0)
+
 except FileNotFoundError:
     print('[ERROR] ../etc/conf.cfg was not found. Copy conf.cfg.sample to conf.cfg and update its contents.')
     sys.exit(0)
 
 CHATS = {}
 USERS = {}
+USERS_PENDING = {}
+
+chats_directory = directory.ChatDirectory(directory_path)
+emoji_cache = EmojiCache(chats_directory, max_size=emojis_cache_size, downloads=emojis_downloads)
 
 
 def unpack_datetime(datetime_obj):
@@ -131,31 +182,44 @@ async def _unpack_author(author):
     #     return
     else:
         meta = {}
-    if USERS[author.id]:
+    if USERS.get(author.id):
         if 'info' in USERS[author.id]:
             meta['info'] = USERS[author.id]['info']
         if 'icon' in USERS[author.id]:
             meta['icon'] = USERS[author.id]['icon']
     return meta
 
+async def _fetch_user_profile(user):
+    meta = {'id': user.id}
+    try:
+        profile = await user.profile()
+        if profile.bio:
+            meta['info'] = profile.bio
+        if profile.avatar:
+            # raw image, base64 encoded once by the convert stage
+            meta['avatar'] = await profile.avatar.read()
+
+        # print(meta)
+        # sys.exit(0)
+    except discord.errors.NotFound:
+        pass
+    USERS[user.id] = meta
+    user_meta = _unpack_user(user)
+    if 'info' in meta:
+        user_meta['info'] = meta['info']
+    await asyncio.to_thread(chats_directory.update_user, user_meta)
+    return meta
+
 async def get_user_profile(user):  # TODO Restrict by guild ???
     if user.id in USERS:
-        meta = USERS[user.id]
-    else:
-        meta = {'id': user.id}
-        try:
-            profile = await user.profile()
-            if profile.bio:
-                meta['info'] = profile.bio
-            if profile.avatar:
-                meta['icon'] = base64.standard_b64encode(await profile.avatar.read()).decode()
-
-            # print(meta)
-            # sys.exit(0)
-        except discord.errors.NotFound:
-            pass
-        USERS[user.id] = meta
-    return meta
+        return USERS[user.id]
+    # concurrent enrich workers share the profile lookup of a new user
+    task = USERS_PENDING.get(user.id)
+    if not task:
+        task = asyncio.ensure_future(_fetch_user_profile(user))
+        USERS_PENDING[user.id] = task
+        task.add_done_callback(lambda t, user_id=user.id: USERS_PENDING.pop(user_id, None))
+    return await asyncio.shield(task)
 
 async def _unpack_guild(chat, media=False):
     meta = {'id': chat.id, 'name': chat.name, 'type': 'server'}
@@ -259,55 +323,37 @@ def _unpack_thread(thread):
     # owner
 
     meta['parent']['chat'] = thread.guild.id
-    meta['parent']['subchannel'] = thread.channel.id
+    # thread.parent can be None if the parent channel is not cached
+    meta['parent']['subchannel'] = thread.parent_id
 
     # meta['thread']['parent']['message'] = meta['thread']['id']
 
     return meta
 
 def _unpack_embedded(embedded):
-    # TODO CHECK
-    # + image
-    # + thumbnail
-    # + video
-    # + provider
-    # + author
-    # timestamp ???
-
-    embed = embedded.to_dict()
-    content = ''  # TODO icon URL
-    if 'title' in embed:
-        if 'url' in embed:
-            content = f'[{embed["title"]}]({embed["url"]})\n'
-        else:
-            content = f'{embed["title"]}\n'
-    elif 'url' in embed:
-        content = f'{embed["url"]}\n'
-    if 'description' in embed:
-        content = f'{content}{embed["description"]}\n'
-    for field in embed.get('fields', []):
-        if field['inline']:
-            content = f'{content}{field["name"]}    {field["value"]}\n'
-        else:
-            content = f'{content}{field["name"]}\n{field["value"]}\n'
-    if embed.get('footer'):
-        content = f'{content}\n'
-        if 'icon_url' in embed['footer']:
-            content = f'{content}{embed["footer"]["icon_url"]}\n'
-        if 'text' in embed['footer']:
-            content = f'{content}{embed["footer"]["text"]}\n'
-    # print(content)
-    return content
+    return unpack_embedded(embedded.to_dict())
 
-async def get_attachment(meta, attachment, download=False):
+async def get_attachment(attachment, download=False):
     print(attachment.to_dict())
     print(attachment.content_type)
     if attachment.content_type and download:
         if attachment.content_type.startswith('image'):
-            media_content = await attachment.read()
-            meta['type'] = 'image'
-            if ail:
-                ail.feed_json_item(media_content, meta, 'discord', feeder_uuid)
+            return await attachment.read()
+    return None
+
+def _unpack_emoji(emoji):
+    if isinstance(emoji, str):
+        return {'name': emoji}
+    meta = {'name': emoji.name}
+    if emoji.id:
+        meta['id'] = emoji.id
+        meta['animated'] = emoji.animated
+    return meta
+
+def _unpack_reaction(reaction):
+    meta = {'emoji': _unpack_emoji(reaction.emoji),
+            'count': reaction.count}
+    return meta
 
 def _unpack_reference(reference):
     meta = {}
@@ -343,10 +389,23 @@ def get_reply_to(meta): # TODO check if reference is not None
 
     return reply_to
 
+def _get_embeds_content(message):
+    content = ''
+    if message.embeds:
+        for embedded in message.embeds:
+            content = f'{content}\n{_unpack_embedded(embedded)}'
+    return content
+
+def _get_message_source(message):
+    source = {'channel': message.channel.id}
+    if message.guild:
+        source['chat'] = message.guild.id
+    return source
+
 # TODO extract chat mentions/urls
 # discord.gg hostname -> invite code
 # discord.com hostname + 'invite -> invite code
-async def _unpack_message(message, download=False):
+async def _enrich_message(message, duplicates=None, download=False):
     meta = {'id': message.id, 'type': 'message'}
     if message.edited_at:
         meta['edit_date'] = unpack_datetime(message.edited_at)
@@ -366,17 +425,13 @@ async def _unpack_message(message, download=False):
             else:
                 meta['chat']['subchannel'] = _unpack_guid_channel(message.channel)
 
+    custom_emojis = []
     if message.reactions:
+        meta['reactions'] = []
         for reaction in message.reactions:
-            print(reaction)
-            print(reaction.is_custom_emoji())
-            print(reaction.emoji)
+            meta['reactions'].append(_unpack_reaction(reaction))
             if reaction.is_custom_emoji():
-                print(reaction.emoji.url)
-            # print(await reaction.emoji.read())
-            # if not reaction.is_custom_emoji():
-            print(meta['chat'])
-        # sys.exit(0)
+                custom_emojis.append(reaction.emoji)
 
     # mentions
     # raw_mentions
@@ -401,60 +456,172 @@ async def _unpack_message(message, download=False):
     print()
     # print(json.dumps(meta, indent=4, sort_keys=True))
 
-    content = ''
-    if message.embeds:
-        for embedded in message.embeds:
-            content = f'{content}\n{_unpack_embedded(embedded)}'
-            # print()
-            # print('------------------------------------------------------------------')
-            # print()
-
-    meta['data'] = f'{message.content}\n{content}'
-    data = f'{message.content}{content}'
+    if duplicates:
+        meta['duplicates'] = duplicates
 
-    # if message.embeds:
-    # print(json.dumps(meta, indent=4, sort_keys=True))
-
-    if data:
-        if ail:
-            ail.feed_json_item(data, meta, 'discord', feeder_uuid)
-    # else:
-    #     if message.attachments:
-    #         # print(meta)
-    #         print()
-    #         print(message.attachments)          # -> file
-    #         print(message.system_content)       # discord.embeds
-    #         print()
-    #         # print(json.dumps(meta, indent=4, sort_keys=True))
-    #         # sys.exit(0)
+    # plain record, converted by a pure function in the convert stage
+    record = {'meta': meta,
+              'content': message.content,
+              'embeds': [embedded.to_dict() for embedded in message.embeds],
+              'attachments': [],
+              'emojis': []}
+    if 'icon' not in meta['sender']:
+        avatar = USERS.get(message.author.id, {}).get('avatar')
+        if avatar:
+            record['avatar'] = avatar
 
     if message.attachments:
         for attachment in message.attachments:
-            await get_attachment(meta, attachment, download=download)
-
-    print(json.dumps(meta, indent=4, sort_keys=True))
+            media_content = await get_attachment(attachment, download=download)
+            if media_content:
+                record['attachments'].append(media_content)
+
+    # each custom emoji image is fetched and fed once
+    if custom_emojis and download:
+        record['emojis'] = await emoji_cache.fetch(custom_emojis)
+
+    return record
+
+def _emit_item(item):
+    if 'sender_icon' in item:
+        user = USERS.get(item['meta']['sender']['id'])
+        if user:
+            user['icon'] = item['sender_icon']
+            user.pop('avatar', None)
+            chats_directory.update_user({'id': user['id'], 'icon': user['icon']})
+    if 'emoji' in item:
+        # not recorded if the feed fails: downloaded again next time it's seen
+        try:
+            if item['data'] and ail:
+                ail.feed_json_item(item['data'], item['meta'], 'discord', feeder_uuid)
+                emoji_cache.mark_fed(item['emoji'])
+        finally:
+            emoji_cache.discard_queued(item['emoji']['id'])
+    elif item['data']:
+        if ail:
+            ail.feed_json_item(item['data'], item['meta'], 'discord', feeder_uuid)
+    if 'dump' in item:
+        print(item['dump'])
+
+def _drop_records(records):
+    for record in records:
+        for emoji in record.get('emojis', []):
+            emoji_cache.discard_queued(emoji['meta']['id'])
+
+def _create_pipeline(download=False):
+    return MessagePipeline(functools.partial(_enrich_message, download=download), convert_messages, _emit_item,
+                           batch_size=pipeline_batch_size,
+                           enrich_workers=pipeline_enrich_workers,
+                           processes=pipeline_processes,
+                           drop=_drop_records)
+
+async def _close_pipeline(pipeline):
+    await _flush_duplicates(pipeline, flush_all=True)
+    await pipeline.close()
+
+async def _flush_duplicates(pipeline, flush_all=False):
+    if not dedup:
+        return
+    if flush_all:
+        entries = dedup.flush()
+    else:
+        entries = dedup.expired()
+    for entry in entries:
+        if entry['count'] > 1:
+            duplicates = {'count': entry['count'], 'sources': entry['sources']}
+            if entry['other_urls']:
+                duplicates['urls'] = entry['other_urls']
+        else:
+            duplicates = None
+        await pipeline.put(entry['item'], duplicates)
+
+async def _process_message(pipeline, message):
+    # Near-duplicates are held and collapsed before any profile fetch or AIL submission,
+    # messages with attachments are never collapsed: their medias would be lost
+    if dedup and not message.attachments:
+        data = f'{message.content}{_get_embeds_content(message)}'
+        if dedup.add(data, message, _get_message_source(message)) is not None:
+            await _flush_duplicates(pipeline)
+            return
+    await pipeline.put(message)
+
+def _get_directory_channel(channel):
+    if isinstance(channel, discord.Thread):
+        return directory.THREAD, _unpack_thread(channel), channel.parent_id
+    elif isinstance(channel, discord.abc.GuildChannel):
+        return directory.SUBCHANNEL, _unpack_guid_channel(channel), channel.guild.id
+    else:
+        meta = _unpack_private_channel(channel)
+        if meta:
+            return meta['type'], meta, None
+    return None
 
-    return meta
+async def _get_directory_guild(guild):
+    chats = [(directory.SERVER, await _unpack_guild(guild), None)]
+    for channel in guild.channels:
+        chats.append(_get_directory_channel(channel))
+    for thread in guild.threads:
+        chats.append(_get_directory_channel(thread))
+    return chats
+
+async def _refresh_directory(client):
+    chats = []
+    for guild in client.guilds:
+        chats.extend(await _get_directory_guild(guild))
+    for channel in client.private_channels:
+        chats.append(_get_directory_channel(channel))
+    chats = [chat for chat in chats if chat]
+    users = [_unpack_user(user) for user in client.users]
+    await asyncio.to_thread(chats_directory.replace_chats, chats)
+    await asyncio.to_thread(chats_directory.update_users, users)
+
+# SQLite writes run in a thread, off the gateway event loop
+
+async def _update_directory_guild(guild):
+    chats = [chat for chat in await _get_directory_guild(guild) if chat]
+    await asyncio.to_thread(chats_directory.update_chats, chats)
+
+async def _update_directory_channel(channel):
+    chat = _get_directory_channel(channel)
+    if chat:
+        await asyncio.to_thread(chats_directory.update_chat, *chat)
+
+async def _delete_directory_chat(chat_id):
+    await asyncio.to_thread(chats_directory.delete_chat, chat_id)
+
+async def _flush_duplicates_loop(pipeline, delay=5):
+    while True:
+        await asyncio.sleep(delay)
+        await _flush_duplicates(pipeline)
 
 
 # # # # # # # # # # # # # # # #
 #           CLI               #
 # # # # # # # # # # # # # # # #
 
-def get_entity(entity):
-    class DiscordGetEntity(discord.Client):
+class FeederClient(discord.Client):
+    async def setup_hook(self):
+        # profiling hooks, no-op if not enabled
+        profiling.track('USERS', lambda: USERS)
+        profiling.track('CHATS', lambda: CHATS)
+        profiling.track('discord.users', lambda: self.users, deep=False)
+        profiling.track('discord.guilds', lambda: self.guilds, deep=False)
+        profiling.track('discord.private_channels', lambda: self.private_channels, deep=False)
+        profiling.track('discord.cached_messages', lambda: self.cached_messages, deep=False)
+        self.profiling_task = profiling.attach_loop(asyncio.get_running_loop())
+
+def get_entity(entity, refresh=False):
+    if not refresh:
+        meta = chats_directory.get_entity(int(entity))
+        if meta:
+            print(json.dumps(meta, indent=4, sort_keys=True))
+            return
+
+    class DiscordGetEntity(FeederClient):
         async def on_ready(self):
+            await _refresh_directory(self)
             entity_id = int(entity)
-            meta = {}
-            guild = self.get_guild(entity_id)
-            if guild:
-                meta = await _unpack_guild(guild)
-                meta['subchannels'] = []
-                for channel in guild.channels:
-                    meta['subchannels'].append(_unpack_channel(channel))
-            channel = self.get_channel(entity_id)
-            if channel:
-                meta = _unpack_channel(channel)
+            meta = await _get_live_chat(self, entity_id)
             # for channel in self.private_channels:
             #     print(channel.id)
             #     if entity_id == channel.id:
@@ -467,9 +634,94 @@ def get_entity(entity):
     client = DiscordGetEntity()
     client.run(token)
 
-def get_chats(l_channels=False):
-    class DiscordChats(discord.Client):
+async def _get_live_chat(client, entity_id):
+    meta = {}
+    guild = client.get_guild(entity_id)
+    if guild:
+        meta = await _unpack_guild(guild)
+        meta['subchannels'] = []
+        for channel in guild.channels:
+            meta['subchannels'].append(_unpack_channel(channel))
+    channel = client.get_channel(entity_id)
+    if channel:
+        meta = _unpack_channel(channel)
+    return meta
+
+async def _resolve_entity(client, entity_id):
+    meta = await _get_live_chat(client, entity_id)
+    if meta:
+        return meta
+    user = client.get_user(entity_id)
+    if not user:
+        user = await client.fetch_user(entity_id)
+    meta = _unpack_user(user)
+    # profile cached in USERS and in the directory by get_user_profile
+    # rate limited requests are retried by discord.py
+    profile = await get_user_profile(user)
+    if 'info' in profile:
+        meta['info'] = profile['info']
+    if 'icon' not in profile and profile.get('avatar'):
+        profile['icon'] = base64.standard_b64encode(profile.pop('avatar')).decode()
+        await asyncio.to_thread(chats_directory.update_user, {'id': user.id, 'icon': profile['icon']})
+    if 'icon' in profile:
+        meta['icon'] = profile['icon']
+    return meta
+
+def _print_ndjson(meta):
+    print(json.dumps(meta, sort_keys=True), flush=True)
+
+def get_entities(entities, refresh=False, concurrency=8):
+    # Resolve a batch of chats/users IDs with a single login, results are streamed as NDJSON
+    entity_ids = []
+    for entity in entities:
+        try:
+            entity_ids.append(int(entity))
+        except ValueError:
+            _print_ndjson({'id': entity, 'error': 'Invalid ID'})
+    # each ID is resolved once, in input order
+    entity_ids = list(dict.fromkeys(entity_ids))
+
+    # answer from the local directory first
+    if not refresh:
+        unknown_ids = []
+        for entity_id in entity_ids:
+            meta = chats_directory.get_entity(entity_id)
+            if meta:
+                _print_ndjson(meta)
+            else:
+                unknown_ids.append(entity_id)
+        entity_ids = unknown_ids
+    if not entity_ids:
+        return
+
+    class DiscordGetEntities(FeederClient):
+        async def on_ready(self):
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def resolve(entity_id):
+                async with semaphore:
+                    try:
+                        _print_ndjson(await _resolve_entity(self, entity_id))
+                    except discord.NotFound:
+                        _print_ndjson({'id': entity_id, 'error': 'Not found'})
+                    except Exception as e:
+                        _print_ndjson({'id': entity_id, 'error': f'{type(e).__name__}: {e}'})
+
+            try:
+                await asyncio.gather(*[resolve(entity_id) for entity_id in entity_ids])
+            finally:
+                await self.close()
+    client = DiscordGetEntities()
+    client.run(token)
+
+def get_chats(l_channels=False, refresh=False):
+    if not refresh and not chats_directory.is_empty():
+        print(json.dumps(chats_directory.get_chats(subchannels=l_channels), indent=4, sort_keys=True))
+        return
+
+    class DiscordChats(FeederClient):
         async def on_ready(self):
+            await _refresh_directory(self)
             chats = []
             for guild in self.guilds:
                 meta = await _unpack_guild(guild)
@@ -486,15 +738,15 @@ def get_chats(l_channels=False):
     client = DiscordChats()
     client.run(token)
 
-async def _get_messages(entity, download=False, limit=20):
+async def _get_messages(pipeline, entity, limit=20):
     try:
         async for message in entity.history(limit=limit):
             print(message)
-            await _unpack_message(message, download=download)
+            await _process_message(pipeline, message)
     except discord.errors.Forbidden as e:
         print(e)
 
-async def _get_guild_messages(guild, download=False, replies=False, limit=20):
+async def _get_guild_messages(pipeline, guild, replies=False, limit=20):
     for channel in guild.channels:
         print(type(channel))
         if isinstance(channel, discord.CategoryChannel):
@@ -507,31 +759,38 @@ async def _get_guild_messages(guild, download=False, replies=False, limit=20):
                 async for thread in channel.archived_threads(limit=None):
                     print(thread.id)
                     print()
-                    await _get_messages(thread, download=download, limit=limit)  # TODO threat metas
+                    await _get_messages(pipeline, thread, limit=limit)  # TODO threat metas
 
             except discord.errors.Forbidden as e:
                 print(e)
         elif channel.last_message_id:
-            await _get_messages(channel, download=download, limit=limit)
+            await _get_messages(pipeline, channel, limit=limit)
         else:
             pass
             # TODO ERROR MESSAGE
 
 def get_chat_messages(entity, download=False, replies=False, limit=5):
-    class DiscordMessage(discord.Client):
+    class DiscordMessage(FeederClient):
         async def on_ready(self):
             entity_id = int(entity)
+            pipeline = _create_pipeline(download=download)
+            pipeline.start()
             for guild in self.guilds:
                 if entity_id == guild.id:
-                    await _get_guild_messages(guild, download=download, replies=replies, limit=limit)
+                    await _get_guild_messages(pipeline, guild, replies=replies, limit=limit)
+                    await _close_pipeline(pipeline)
                     await self.close()
+                    return
 
             for channel in self.private_channels:
                 if entity_id == channel.id:
-                    await _get_messages(channel, limit=limit)
+                    await _get_messages(pipeline, channel, limit=limit)
+                    await _close_pipeline(pipeline)
                     await self.close()
+                    return
 
             print(f'Unknown chat: {entity_id}')
+            await _close_pipeline(pipeline)
             await self.close()
 
     client = DiscordMessage()
@@ -574,23 +833,26 @@ def get_chat_messages(entity, download=False, replies=False, limit=5):
 
 
 def get_all_messages(download=False, replies=False, limit=80):
-    class DiscordAllMessages(discord.Client):
+    class DiscordAllMessages(FeederClient):
         async def on_ready(self):
+            pipeline = _create_pipeline(download=download)
+            pipeline.start()
             for guild in self.guilds:
-                await _get_guild_messages(guild, download=download, replies=replies, limit=limit)
+                await _get_guild_messages(pipeline, guild, replies=replies, limit=limit)
                 # print('---------------------------------')
                 # print(guild.threads)
 
             for channel in self.private_channels:
-                await _get_messages(channel, download=download, limit=limit)
+                await _get_messages(pipeline, channel, limit=limit)
 
+            await _close_pipeline(pipeline)
             await self.close()
     client = DiscordAllMessages()
     client.run(token)
 
 
 def join_guild(guild_id):
-    class DiscordJoinGuild(discord.Client):
+    class DiscordJoinGuild(FeederClient):
         async def on_ready(self):
             print(f'Logged in as {self.user} (ID: {self.user.id})')
             print('------')
@@ -607,7 +869,7 @@ def join_guild(guild_id):
     client.run(token)
 
 def leave_guild(guild_id):
-    class DiscordLeaveGuild(discord.Client):
+    class DiscordLeaveGuild(FeederClient):
         async def on_ready(self):
             print(f'Logged in as {self.user} (ID: {self.user.id})')
             print('------')
@@ -623,14 +885,65 @@ def leave_guild(guild_id):
 
 
 def monitor(download=False):
-    class DiscordMonitor(discord.Client):
+    class DiscordMonitor(FeederClient):
+        async def setup_hook(self):
+            await super().setup_hook()
+            self.pipeline = _create_pipeline(download=download)
+            self.pipeline.start()
+            if dedup:
+                self.dedup_task = asyncio.create_task(_flush_duplicates_loop(self.pipeline))
+
+        async def close(self):
+            if getattr(self, 'dedup_task', None):
+                self.dedup_task.cancel()
+            if getattr(self, 'pipeline', None):
+                await _close_pipeline(self.pipeline)
+                self.pipeline = None
+            await super().close()
+
         async def on_ready(self):
             print(f'Logged in as {self.user} (ID: {self.user.id})')
             print('------')
+            await _refresh_directory(self)
 
         async def on_message(self, message):
             print(message)
-            await _unpack_message(message, download=download)
+            await _process_message(self.pipeline, message)
+
+        # Directory incremental updates
+
+        async def on_guild_join(self, guild):
+            await _update_directory_guild(guild)
+
+        async def on_guild_update(self, before, after):
+            await asyncio.to_thread(chats_directory.update_chat, directory.SERVER, await _unpack_guild(after))
+
+        async def on_guild_remove(self, guild):
+            await _delete_directory_chat(guild.id)
+
+        async def on_guild_channel_create(self, channel):
+            await _update_directory_channel(channel)
+
+        async def on_guild_channel_update(self, before, after):
+            await _update_directory_channel(after)
+
+        async def on_guild_channel_delete(self, channel):
+            await _delete_directory_chat(channel.id)
+
+        async def on_thread_create(self, thread):
+            await _update_directory_channel(thread)
+
+        async def on_thread_update(self, before, after):
+            await _update_directory_channel(after)
+
+        async def on_thread_delete(self, thread):
+            await _delete_directory_chat(thread.id)
+
+        async def on_private_channel_create(self, channel):
+            await _update_directory_channel(channel)
+
+        async def on_private_channel_delete(self, channel):
+            await _delete_directory_chat(channel.id)
     client = DiscordMonitor()
     client.run(token)
 
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Custom emojis cache
+
+Bounded LRU of fed emojis keyed by emoji ID, persisted in the chats directory.
+Each custom emoji image is downloaded, and fed, once: an emoji is only recorded
+once its image is fed to AIL, downloaded images waiting to be fed are not
+downloaded again during the run.
+"""
+
+import asyncio
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+
+class EmojiCache:
+
+    def __init__(self, chats_directory, max_size=10000, downloads=4):
+        self.directory = chats_directory
+        self.max_size = max_size
+        self.downloads = downloads
+        self.semaphore = None
+        self.emojis = OrderedDict()
+        self.pending = {}  # downloads in progress
+        self.queued = set()  # downloaded, waiting to be fed
+        # mark_fed() is called from the pipeline emit thread
+        self.lock = threading.Lock()
+
+    def _set(self, emoji_id, meta):
+        with self.lock:
+            self.emojis[emoji_id] = meta
+            self.emojis.move_to_end(emoji_id)
+            while len(self.emojis) > self.max_size:
+                self.emojis.popitem(last=False)
+
+    def _get(self, emoji_id):
+        with self.lock:
+            meta = self.emojis.get(emoji_id)
+            if meta:
+                self.emojis.move_to_end(emoji_id)
+            return meta
+
+    async def get(self, emoji_id):
+        meta = self._get(emoji_id)
+        if meta:
+            return meta
+        # SQLite lookup off the event loop
+        meta = await asyncio.to_thread(self.directory.get_emoji, emoji_id)
+        if meta:
+            self._set(emoji_id, meta)
+        return meta
+
+    def mark_fed(self, meta):
+        """Record an emoji once its image is fed."""
+        self.directory.update_emoji(meta)
+        self._set(meta['id'], meta)
+        self.discard_queued(meta['id'])
+
+    def discard_queued(self, emoji_id):
+        """Forget a downloaded emoji, fed or not: download it again if it wasn't recorded."""
+        with self.lock:
+            self.queued.discard(emoji_id)
+
+    async def _download(self, emoji):
+        if await self.get(emoji.id):
+            return None
+        async with self.semaphore:
+            image = await emoji.read()
+        meta = {'id': emoji.id,
+                'name': emoji.name,
+                'animated': emoji.animated,
+                'sha256': hashlib.sha256(image).hexdigest()}
+        with self.lock:
+            self.queued.add(emoji.id)
+        return {'meta': meta, 'image': image}
+
+    async def fetch(self, emojis):
+        """
+        Concurrently download the custom emojis never fed before.
+
+        :return: list of {'meta': ..., 'image': ...} to feed
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.downloads)
+        tasks = []
+        for emoji in emojis:
+            # being downloaded/fed for another message
+            with self.lock:
+                if emoji.id in self.pending or emoji.id in self.queued:
+                    continue
+            if self._get(emoji.id):
+                continue
+            # registered before any await: concurrent fetches of the same emoji share the lookup
+            task = asyncio.ensure_future(self._download(emoji))
+            self.pending[emoji.id] = task
+            task.add_done_callback(lambda t, emoji_id=emoji.id: self.pending.pop(emoji_id, None))
+            tasks.append(task)
+
+        fetched = []
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f'[ERROR] Failed to download emoji: {result}')
+            elif result:
+                fetched.append(result)
+        return fetched
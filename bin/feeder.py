@@ -3,10 +3,12 @@
 
 import argparse
 # import configparser
-# import sys
-# import os
+import sys
+import os
 
-import discordlib
+from datetime import datetime
+
+import profiling
 
 
 def _create_messages_subparser(subparser):
@@ -16,16 +18,43 @@ def _create_messages_subparser(subparser):
     subparser.add_argument('--save_dir', help='Directory to save downloaded medias')
     # subparser.add_argument('--mark_as_read', action='store_true', help='Mark messages as read')
 
+def _create_profiling_parser(parser):
+    parser.add_argument('--profile_cpu', action='store_true', help='Sampling CPU profiles (folded stacks)')
+    parser.add_argument('--profile_memory', action='store_true', help='tracemalloc snapshots, top allocators and caches sizes')
+    parser.add_argument('--profile_loop', action='store_true', help='asyncio slow callbacks and event loop lag, enables asyncio debug mode')
+    parser.add_argument('--profile_dir', help='Directory to save profiling reports, default: data/profiles/<date>')
+    parser.add_argument('--profile_interval', type=int, default=60, help='Seconds between two profiling reports')
+    parser.add_argument('--slow_callback', type=float, default=0.1, help='Slow callback duration threshold in seconds')
+
+def _start_profiling(args):
+    if not (args.profile_cpu or args.profile_memory or args.profile_loop):
+        return
+    if args.profile_dir:
+        profile_dir = args.profile_dir
+    else:
+        profile_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../data/profiles',
+                                   datetime.now().strftime('%Y%m%d-%H%M%S'))
+    profiling.start(profile_dir, interval=args.profile_interval,
+                    cpu=args.profile_cpu, memory=args.profile_memory, loop=args.profile_loop,
+                    slow_callback=args.slow_callback)
+    print(f'[INFO] Profiling reports: {profile_dir}')
+
 # def _json_print(mess):
 #     print(json.dumps(mess, indent=4, sort_keys=True))
 
 
 if __name__ == '__main__':
+    # Imported here: spawned convert workers re-import this module, discordlib import parses the config,
+    # connects to AIL and opens the directory
+    import discordlib
+
     parser = argparse.ArgumentParser(description='Discord feeder')
+    _create_profiling_parser(parser)
 
     subparsers = parser.add_subparsers(dest='command')
 
     list_chats_parser = subparsers.add_parser('chats', help='List all joined chats')
+    list_chats_parser.add_argument('--refresh', action='store_true', help='Get live data instead of the local directory')
 
     # join_chat_parser = subparsers.add_parser('join', help='Join a chat by its id, username or with a hash invite')
     # join_chat_parser.add_argument('-n', '--name', type=str, help='ID, hash or username of the chat to join')
@@ -56,9 +85,13 @@ if __name__ == '__main__':
     # join ? leave ? shortcut
 
     get_metas_parser = subparsers.add_parser('entity', help='Get chat or user metadata')
-    get_metas_parser.add_argument('entity_name', help='ID, hash or username of the chat/user')
+    get_metas_parser.add_argument('entity_name', nargs='?', help='ID, hash or username of the chat/user')
+    get_metas_parser.add_argument('--bulk', metavar='FILE', help='File of IDs, one per line (- for stdin), NDJSON output')
+    get_metas_parser.add_argument('--concurrency', type=int, default=8, help='Max concurrent lookups in bulk mode')
+    get_metas_parser.add_argument('--refresh', action='store_true', help='Get live data instead of the local directory')
 
     args = parser.parse_args()
+    _start_profiling(args)
 
     # Call the corresponding function based on the command
     if args.command == 'monitor':
@@ -69,7 +102,7 @@ if __name__ == '__main__':
         discordlib.monitor(download=download)
     else:
         if args.command == 'chats':
-            r = discordlib.get_chats(l_channels=False)
+            r = discordlib.get_chats(l_channels=False, refresh=args.refresh)
         # elif args.command == 'join':
         #     if not args.name and not args.invite:
         #         join_chat_parser.print_help()
@@ -128,7 +161,19 @@ if __name__ == '__main__':
         #     else:
         #         discordlib.get_entity(chat)
         elif args.command == 'entity':
-            entity = args.entity_name
-            discordlib.get_entity(entity)
+            if args.concurrency < 1:
+                get_metas_parser.error('--concurrency must be >= 1')
+            if args.bulk:
+                if args.bulk == '-':
+                    entities = sys.stdin.read().split()
+                else:
+                    with open(args.bulk) as f:
+                        entities = f.read().split()
+                discordlib.get_entities(entities, refresh=args.refresh, concurrency=args.concurrency)
+            elif args.entity_name:
+                entity = args.entity_name
+                discordlib.get_entity(entity, refresh=args.refresh)
+            else:
+                get_metas_parser.print_help()
         else:
             parser.print_help()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Staged message pipeline: Fetch -> Enrich -> Convert -> Emit
+
+- Fetch: producers (gateway events, history) put items in the fetch queue
+- Enrich: async workers, network lookups (profiles, attachments)
+- Convert: pure and synchronous, batches run in an executor (thread or process pool)
+- Emit: blocking AIL submission, run in a thread
+
+Each stage has its own bounded queue, CPU-heavy encoding and AIL I/O never run on the event loop.
+"""
+
+import asyncio
+import multiprocessing
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class MessagePipeline:
+
+    def __init__(self, enrich, convert, emit, batch_size=50, enrich_workers=4, processes=0, queue_size=1000,
+                 drop=None):
+        """
+        :param enrich: coroutine function, fetched item -> record (None to drop it)
+        :param convert: pure function, list of records -> list of items, must be picklable if processes
+        :param emit: blocking function, item -> None
+        :param processes: number of worker processes used to convert batches, 0: use a thread
+        :param drop: function, list of records -> None, called with the records of a failed convert batch
+        """
+        self.enrich = enrich
+        self.convert = convert
+        self.emit = emit
+        self.drop = drop
+        self.batch_size = batch_size
+        self.enrich_workers = enrich_workers
+        self.processes = processes
+
+        self.fetch_queue = asyncio.Queue(maxsize=queue_size)
+        self.convert_queue = asyncio.Queue(maxsize=queue_size)
+        self.emit_queue = asyncio.Queue(maxsize=queue_size)
+
+        self.executor = None
+        self.tasks = []
+
+    def start(self):
+        if self.processes:
+            # spawn: don't fork a process running an event loop and the gateway threads
+            self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        for _ in range(self.enrich_workers):
+            self.tasks.append(asyncio.create_task(self._enrich_worker()))
+        self.tasks.append(asyncio.create_task(self._convert_worker()))
+        self.tasks.append(asyncio.create_task(self._emit_worker()))
+
+    async def put(self, *item):
+        await self.fetch_queue.put(item)
+
+    async def _enrich_worker(self):
+        while True:
+            item = await self.fetch_queue.get()
+            try:
+                record = await self.enrich(*item)
+                if record is not None:
+                    await self.convert_queue.put(record)
+            except Exception:
+                print('[ERROR] Failed to enrich message')
+                traceback.print_exc()
+            finally:
+                self.fetch_queue.task_done()
+
+    async def _convert_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            records = [await self.convert_queue.get()]
+            while len(records) < self.batch_size and not self.convert_queue.empty():
+                records.append(self.convert_queue.get_nowait())
+            try:
+                items = await loop.run_in_executor(self.executor, self.convert, records)
+                for item in items:
+                    await self.emit_queue.put(item)
+            except Exception:
+                print('[ERROR] Failed to convert messages')
+                traceback.print_exc()
+                if self.drop:
+                    self.drop(records)
+            finally:
+                for _ in records:
+                    self.convert_queue.task_done()
+
+    async def _emit_worker(self):
+        while True:
+            item = await self.emit_queue.get()
+            try:
+                await asyncio.to_thread(self.emit, item)
+            except Exception:
+                print('[ERROR] Failed to emit item')
+                traceback.print_exc()
+            finally:
+                self.emit_queue.task_done()
+
+    async def join(self):
+        """Wait until all the fetched items are emitted."""
+        await self.fetch_queue.join()
+        await self.convert_queue.join()
+        await self.emit_queue.join()
+
+    async def close(self):
+        await self.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Opt-in profiling hooks
+
+- CPU: sampling profiler of all the threads (event loop, convert and emit workers),
+  folded stacks usable with flamegraph.pl or speedscope
+- Memory: tracemalloc top allocators + size of the tracked caches (USERS, CHATS, discord.py caches)
+- Event loop: asyncio slow callbacks and event loop lag
+
+Reports are written every interval in the output directory, with a whole run report on exit.
+"""
+
+import asyncio
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from datetime import datetime
+
+PROFILER = None
+
+
+def _get_size(obj, seen=None):
+    """Approximate deep size of builtin containers."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _get_size(key, seen) + _get_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for value in obj:
+            size += _get_size(value, seen)
+    return size
+
+def _get_stack(frame):
+    stack = []
+    while frame:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class _SlowCallbackHandler(logging.Handler):
+
+    def __init__(self, profiler):
+        super().__init__(level=logging.WARNING)
+        self.profiler = profiler
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith('Executing '):
+            self.profiler.slow_callbacks += 1
+            self.profiler.write_line('slow-callbacks.log', f'{datetime.now().isoformat()} {message}')
+
+
+class Profiler:
+
+    def __init__(self, output_dir, interval=60, cpu=False, memory=False, loop=False,
+                 sample_rate=0.01, slow_callback=0.1, lag_interval=0.5, top=25):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.cpu = cpu
+        self.memory = memory
+        self.loop = loop
+        self.sample_rate = sample_rate
+        self.slow_callback = slow_callback
+        self.lag_interval = lag_interval
+        self.top = top
+
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.sampler = None
+
+        # CPU
+        self.samples_lock = threading.Lock()
+        self.samples = {}
+        self.total_samples = {}
+        self.cpu_times = {}
+        # Memory
+        self.tracked = {}
+        self.first_snapshot = None
+        self.last_snapshot = None
+        # Event loop
+        self.lags = []
+        self.slow_callbacks = 0
+
+    def _get_path(self, name):
+        return os.path.join(self.output_dir, name)
+
+    def write_line(self, name, line):
+        with self.lock:
+            with open(self._get_path(name), 'a') as f:
+                f.write(f'{line}\n')
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.cpu:
+            self.sampler = threading.Thread(target=self._run_sampler, name='profiler-sampler', daemon=True)
+            self.sampler.start()
+        if self.memory:
+            tracemalloc.start(25)
+            self.first_snapshot = self.last_snapshot = self._take_snapshot()
+        self.thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.sampler:
+            self.sampler.join()
+        # wait for a periodic report in progress
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.dump(final=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self, final=False):
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        if self.cpu:
+            self._dump_cpu(timestamp, final=final)
+        if self.memory:
+            self._dump_memory(timestamp, final=final)
+        if self.loop:
+            self._dump_loop(final=final)
+
+    # -- CPU -- #
+
+    def _run_sampler(self):
+        while not self.stopped.wait(self.sample_rate):
+            self._sample()
+
+    def _is_running(self, thread_id):
+        # thread used CPU since the previous sample, wall clock sampling if the thread CPU clock is not available
+        try:
+            cpu_time = time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+        except (AttributeError, OSError, OverflowError):
+            return True
+        last_cpu_time = self.cpu_times.get(thread_id)
+        self.cpu_times[thread_id] = cpu_time
+        return last_cpu_time is not None and cpu_time > last_cpu_time
+
+    def _sample(self):
+        profiler_threads = {self.sampler.ident, self.thread.ident if self.thread else None}
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        stacks = []
+        for thread_id, frame in frames.items():
+            if thread_id in profiler_threads or not self._is_running(thread_id):
+                continue
+            stacks.append(f'{names.get(thread_id, thread_id)};{_get_stack(frame)}')
+        for thread_id in list(self.cpu_times):
+            if thread_id not in frames:
+                del self.cpu_times[thread_id]
+        with self.samples_lock:
+            for stack in stacks:
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def _write_folded(self, name, samples):
+        with open(self._get_path(name), 'w') as f:
+            for stack, count in sorted(samples.items(), key=lambda x: x[1], reverse=True):
+                f.write(f'{stack} {count}\n')
+
+    def _dump_cpu(self, timestamp, final=False):
+        with self.samples_lock:
+            samples, self.samples = self.samples, {}
+        for stack, count in samples.items():
+            self.total_samples[stack] = self.total_samples.get(stack, 0) + count
+        if samples:
+            self._write_folded(f'cpu-{timestamp}.folded', samples)
+        if final:
+            self._write_folded('cpu-total.folded', self.total_samples)
+
+    # -- Memory -- #
+
+    def track(self, name, getter, deep=True):
+        self.tracked[name] = (getter, deep)
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+
+    def _dump_memory(self, timestamp, final=False):
+        snapshot = self._take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f'current: {current} B, peak: {peak} B', '', '# Tracked']
+        for name, (getter, deep) in self.tracked.items():
+            try:
+                obj = getter()
+                if deep:
+                    lines.append(f'{name}: {len(obj)} entries, ~{_get_size(obj)} B')
+                else:
+                    lines.append(f'{name}: {len(obj)} entries')
+            except Exception as e:
+                lines.append(f'{name}: {e}')
+        lines.extend(['', f'# Top {self.top} allocators'])
+        for stat in snapshot.statistics('lineno')[:self.top]:
+            lines.append(str(stat))
+        lines.extend(['', f'# Top {self.top} growth since previous snapshot'])
+        for stat in snapshot.compare_to(self.last_snapshot, 'lineno')[:self.top]:
+            lines.append(str(stat))
+        if final:
+            lines.extend(['', f'# Top {self.top} growth since start'])
+            for stat in snapshot.compare_to(self.first_snapshot, 'traceback')[:self.top]:
+                lines.append(str(stat))
+                lines.extend(stat.traceback.format(limit=10))
+        self.last_snapshot = snapshot
+        with open(self._get_path(f'memory-{timestamp}.txt'), 'w') as f:
+            f.write('\n'.join(lines))
+            f.write('\n')
+
+    # -- Event Loop -- #
+
+    def attach_loop(self, loop):
+        if not self.loop:
+            return
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.slow_callback
+        logging.getLogger('asyncio').addHandler(_SlowCallbackHandler(self))
+        return loop.create_task(self._watch_loop(loop))
+
+    async def _watch_loop(self, loop):
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            lag = loop.time() - start - self.lag_interval
+            self.lags.append(lag)
+
+    def _dump_loop(self, final=False):
+        lags, self.lags = self.lags, []
+        if final and not lags:
+            return
+        slow_callbacks, self.slow_callbacks = self.slow_callbacks, 0
+        path = self._get_path('loop-lag.csv')
+        if not os.path.exists(path):
+            self.write_line('loop-lag.csv', 'date,samples,mean_lag,max_lag,slow_callbacks')
+        if lags:
+            mean_lag = sum(lags) / len(lags)
+            max_lag = max(lags)
+        else:
+            # no sample: the event loop was blocked during the whole interval
+            mean_lag = max_lag = ''
+        self.write_line('loop-lag.csv', f'{datetime.now().isoformat()},{len(lags)},{mean_lag},{max_lag},{slow_callbacks}')
+
+
+# -- Module API, no-op if profiling is not enabled -- #
+
+def start(output_dir, **kwargs):
+    global PROFILER
+    PROFILER = Profiler(output_dir, **kwargs)
+    PROFILER.start()
+    return PROFILER
+
+def track(name, getter, deep=True):
+    if PROFILER:
+        PROFILER.track(name, getter, deep=deep)
+
+def attach_loop(loop):
+    if PROFILER:
+        return PROFILER.attach_loop(loop)
+    return None
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+
+import converter
+from converter import convert_message, convert_messages, unpack_embedded, unpack_embeds
+
+
+def _get_record(**kwargs):
+    record = {'meta': {'id': 1, 'type': 'message', 'sender': {'id': 42, 'username': 'user'}},
+              'content': 'hello',
+              'embeds': [],
+              'attachments': [],
+              'emojis': []}
+    record.update(kwargs)
+    return record
+
+
+class TestUnpackEmbedded(unittest.TestCase):
+
+    def test_title_url(self):
+        self.assertEqual(unpack_embedded({'title': 'Title', 'url': 'https://example.com'}),
+                         '[Title](https://example.com)\n')
+        self.assertEqual(unpack_embedded({'title': 'Title'}), 'Title\n')
+        self.assertEqual(unpack_embedded({'url': 'https://example.com'}), 'https://example.com\n')
+
+    def test_description_fields_footer(self):
+        embed = {'title': 'Title',
+                 'description': 'Description',
+                 'fields': [{'name': 'a', 'value': '1', 'inline': True},
+                            {'name': 'b', 'value': '2', 'inline': False}],
+                 'footer': {'icon_url': 'https://example.com/icon.png', 'text': 'Footer'}}
+        self.assertEqual(unpack_embedded(embed),
+                         'Title\nDescription\na    1\nb\n2\n\nhttps://example.com/icon.png\nFooter\n')
+
+    def test_empty(self):
+        self.assertEqual(unpack_embedded({}), '')
+        self.assertEqual(unpack_embeds([]), '')
+
+    def test_embeds(self):
+        self.assertEqual(unpack_embeds([{'title': 'a'}, {'title': 'b'}]), '\na\n\nb\n')
+
+
+class TestConvertMessage(unittest.TestCase):
+
+    def test_data(self):
+        items = convert_message(_get_record(embeds=[{'title': 'Title'}]))
+        self.assertEqual(len(items), 1)
+        item = items[0]
+        # meta data has an extra newline between the content and the embeds
+        self.assertEqual(item['data'], 'hello\nTitle\n')
+        self.assertEqual(item['meta']['data'], 'hello\n\nTitle\n')
+        self.assertEqual(json.loads(item['dump']), item['meta'])
+        self.assertNotIn('sender_icon', item)
+
+    def test_data_no_embeds(self):
+        item = convert_message(_get_record())[0]
+        self.assertEqual(item['data'], 'hello')
+        self.assertEqual(item['meta']['data'], 'hello\n')
+
+    def test_avatar(self):
+        item = convert_message(_get_record(avatar=b'\x89PNG'))[0]
+        icon = base64.standard_b64encode(b'\x89PNG').decode()
+        self.assertEqual(item['meta']['sender']['icon'], icon)
+        self.assertEqual(item['sender_icon'], icon)
+
+    def test_attachments_emojis(self):
+        emoji_meta = {'id': 7, 'name': 'pepe', 'animated': False, 'sha256': 'abc'}
+        items = convert_message(_get_record(attachments=[b'image1', b'image2'],
+                                            emojis=[{'meta': emoji_meta, 'image': b'emoji'}]))
+        self.assertEqual(len(items), 4)
+        message_meta = items[0]['meta']
+        for item, data in zip(items[1:3], [b'image1', b'image2']):
+            self.assertEqual(item['data'], data)
+            self.assertEqual(item['meta']['type'], 'image')
+            self.assertEqual(item['meta']['id'], message_meta['id'])
+            self.assertNotIn('dump', item)
+        # the message meta type is unchanged
+        self.assertEqual(message_meta['type'], 'message')
+        self.assertEqual(items[3]['data'], b'emoji')
+        self.assertEqual(items[3]['meta'], dict(emoji_meta, type='emoji'))
+        self.assertEqual(items[3]['emoji'], emoji_meta)
+
+    def test_convert_messages(self):
+        items = convert_messages([_get_record(attachments=[b'image']), _get_record(content='world')])
+        self.assertEqual([item['data'] for item in items], ['hello', b'image', 'world'])
+
+
+class TestConvertPickle(unittest.TestCase):
+
+    def test_pickle(self):
+        records = [_get_record(avatar=b'avatar', embeds=[{'title': 'Title'}], attachments=[b'image'])]
+        self.assertIs(pickle.loads(pickle.dumps(convert_messages)), converter.convert_messages)
+        self.assertEqual(pickle.loads(pickle.dumps(records)), records)
+        items = convert_messages(pickle.loads(pickle.dumps(records)))
+        self.assertEqual(pickle.loads(pickle.dumps(items)), items)
+
+    def test_process_pool(self):
+        records = [_get_record(avatar=b'avatar', embeds=[{'title': 'Title'}], attachments=[b'image'])]
+        expected = convert_messages([_get_record(avatar=b'avatar', embeds=[{'title': 'Title'}],
+                                                 attachments=[b'image'])])
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            self.assertEqual(executor.submit(convert_messages, records).result(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
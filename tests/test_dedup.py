@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+
+import dedup
+from dedup import DuplicateFilter, hamming_distance, simhash
+
+SPAM = '@everyone Free discord nitro for 3 months, claim it before it ends here: https://dlscord-gift.com/claim'
+
+
+class TestSimHash(unittest.TestCase):
+
+    def test_identical(self):
+        self.assertEqual(simhash(SPAM), simhash(SPAM))
+
+    def test_case_and_punctuation(self):
+        self.assertEqual(simhash(SPAM), simhash(SPAM.replace('Free', 'FREE').replace(',', ' !!')))
+
+    def test_different_texts(self):
+        distance = hamming_distance(simhash(SPAM), simhash('hello, how are you all doing today my friends'))
+        self.assertGreater(distance, 7)
+
+    def test_different_urls(self):
+        distance = hamming_distance(simhash('new paste https://pastebin.com/abc123'),
+                                    simhash('new paste https://pastebin.com/zzz999'))
+        self.assertGreater(distance, 3)
+
+
+class TestDuplicateFilter(unittest.TestCase):
+
+    def test_add_merged(self):
+        dedup_filter = DuplicateFilter()
+        self.assertTrue(dedup_filter.add(SPAM, 1, {'channel': 1}))
+        self.assertFalse(dedup_filter.add(SPAM.replace('Free discord nitro', 'FREE DISCORD NITRO'), 2, {'channel': 2}))
+        self.assertFalse(dedup_filter.add(SPAM, 3, {'channel': 2}))
+        self.assertEqual(len(dedup_filter), 1)
+        entries = dedup_filter.flush()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['item'], 1)
+        self.assertEqual(entries[0]['count'], 3)
+        self.assertEqual(entries[0]['sources'], [{'channel': 1}, {'channel': 2}])
+        self.assertEqual(entries[0]['other_urls'], [])
+
+    def test_add_distinct_urls(self):
+        dedup_filter = DuplicateFilter()
+        self.assertTrue(dedup_filter.add('https://pastebin.com/abc123', 1, {'channel': 1}))
+        self.assertTrue(dedup_filter.add('https://pastebin.com/zzz999', 2, {'channel': 1}))
+        self.assertTrue(dedup_filter.add('leak mega.nz/file/AAAA#key1', 3, {'channel': 1}))
+        self.assertTrue(dedup_filter.add('leak mega.nz/file/BBBB#key2', 4, {'channel': 1}))
+        self.assertEqual(len(dedup_filter), 4)
+
+    def test_add_no_features(self):
+        dedup_filter = DuplicateFilter()
+        for text in ('🔥🔥🔥', '???', '!!!', '👍', '', '   '):
+            self.assertIsNone(dedup_filter.add(text, text, {'channel': 1}))
+        self.assertEqual(len(dedup_filter), 0)
+        self.assertEqual(dedup_filter.flush(), [])
+
+    def test_add_merged_keeps_urls(self):
+        text = ('Dump of the leaked database, grab it before it is taken down, all the credentials are inside '
+                'and sorted by domain, enjoy and share with your friends {}')
+        dedup_filter = DuplicateFilter(distance=7)
+        self.assertTrue(dedup_filter.add(text.format('https://pastebin.com/abc123'), 1, {'channel': 1}))
+        # long text, a single different URL stays within the max distance
+        self.assertFalse(dedup_filter.add(text.format('https://pastebin.com/zzz999'), 2, {'channel': 2}))
+        entry = dedup_filter.flush()[0]
+        self.assertEqual(entry['urls'], ['https://pastebin.com/abc123'])
+        self.assertEqual(entry['other_urls'], ['https://pastebin.com/zzz999'])
+
+    def test_expired_window(self):
+        dedup_filter = DuplicateFilter(window=60)
+        with mock.patch.object(dedup.time, 'monotonic', return_value=100):
+            dedup_filter.add(SPAM, 1, {'channel': 1})
+        with mock.patch.object(dedup.time, 'monotonic', return_value=130):
+            dedup_filter.add('hello, how are you all doing today my friends', 2, {'channel': 1})
+        with mock.patch.object(dedup.time, 'monotonic', return_value=159):
+            self.assertEqual(dedup_filter.expired(), [])
+        with mock.patch.object(dedup.time, 'monotonic', return_value=160):
+            self.assertEqual([entry['item'] for entry in dedup_filter.expired()], [1])
+            # expired fingerprints are removed from the index
+            self.assertTrue(dedup_filter.add(SPAM, 3, {'channel': 1}))
+        with mock.patch.object(dedup.time, 'monotonic', return_value=220):
+            self.assertEqual([entry['item'] for entry in dedup_filter.expired()], [2, 3])
+        self.assertEqual(len(dedup_filter), 0)
+        self.assertEqual(dedup_filter.bands, {})
+
+    def test_expired_max_size(self):
+        dedup_filter = DuplicateFilter(window=60, max_size=2)
+        dedup_filter.add(SPAM, 1, {'channel': 1})
+        dedup_filter.add('hello, how are you all doing today my friends', 2, {'channel': 1})
+        self.assertEqual(dedup_filter.expired(), [])
+        dedup_filter.add('the weekly meeting is moved to thursday afternoon', 3, {'channel': 1})
+        self.assertEqual([entry['item'] for entry in dedup_filter.expired()], [1])
+        self.assertEqual(len(dedup_filter), 2)
+
+    def test_flush(self):
+        dedup_filter = DuplicateFilter()
+        dedup_filter.add(SPAM, 1, {'channel': 1})
+        dedup_filter.add('hello, how are you all doing today my friends', 2, {'channel': 1})
+        self.assertEqual([entry['item'] for entry in dedup_filter.flush()], [1, 2])
+        self.assertEqual(len(dedup_filter), 0)
+        self.assertEqual(dedup_filter.bands, {})
+        self.assertEqual(dedup_filter.flush(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../bin'))
+
+from directory import ChatDirectory
+from emojis import EmojiCache
+
+
+class _Emoji:
+
+    def __init__(self, emoji_id, name='pepe', animated=False):
+        self.id = emoji_id
+        self.name = name
+        self.animated = animated
+        self.reads = 0
+
+    async def read(self):
+        self.reads += 1
+        await asyncio.sleep(0.01)
+        return f'image-{self.id}'.encode()
+
+
+class TestEmojiCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = ChatDirectory(':memory:')
+
+    def tearDown(self):
+        self.directory.close()
+
+    def test_concurrent_fetch(self):
+        cache = EmojiCache(self.directory)
+        emoji = _Emoji(1)
+
+        async def fetch():
+            return await asyncio.gather(cache.fetch([emoji]), cache.fetch([emoji]), cache.fetch([emoji, emoji]))
+
+        results = asyncio.run(fetch())
+        self.assertEqual(emoji.reads, 1)
+        self.assertEqual(sum(len(fetched) for fetched in results), 1)
+        self.assertEqual(cache.queued, {1})
+        self.assertEqual(cache.pending, {})
+
+    def test_mark_fed(self):
+        cache = EmojiCache(self.directory)
+        emoji = _Emoji(1)
+        fetched = asyncio.run(cache.fetch([emoji]))
+        self.assertEqual(fetched[0]['image'], b'image-1')
+        # queued: not downloaded again before being fed
+        self.assertEqual(asyncio.run(cache.fetch([emoji])), [])
+        cache.mark_fed(fetched[0]['meta'])
+        self.assertEqual(cache.queued, set())
+        self.assertEqual(self.directory.get_emoji(1), fetched[0]['meta'])
+
+        # persisted: a new cache doesn't download it again
+        cache = EmojiCache(self.directory)
+        self.assertEqual(asyncio.run(cache.fetch([emoji])), [])
+        self.assertEqual(emoji.reads, 1)
+        self.assertEqual(asyncio.run(cache.get(1)), fetched[0]['meta'])
+
+    def test_not_fed(self):
+        cache = EmojiCache(self.directory)
+        emoji = _Emoji(1)
+        fetched = asyncio.run(cache.fetch([emoji]))
+        # feed failed
+        cache.discard_queued(fetched[0]['meta']['id'])
+        self.assertIsNone(self.directory.get_emoji(1))
+        self.assertEqual(len(asyncio.run(cache.fetch([emoji]))), 1)
+        self.assertEqual(emoji.reads, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()